@@ -62,13 +62,14 @@ class Flattenable(object):
         json.dump(self.asdict(), writer, **kwargs)
         return writer.getvalue()
 
-    def _asyaml(self, data: Dict[str, Any]) -> str:
+    def _asyaml(self, data: Dict[str, Any], sort_keys: bool = True) -> str:
         writer = StringIO()
         yaml.dump(
             data,
             stream=writer,
             Dumper=_Dumper,
-            default_flow_style=False)
+            default_flow_style=False,
+            sort_keys=sort_keys)
         return writer.getvalue()
 
     def asyaml(self) -> str:
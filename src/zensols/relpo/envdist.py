@@ -3,23 +3,34 @@
 """
 from __future__ import annotations
 __author__ = 'Paul Landes'
-from typing import Tuple, List, Dict, Set, Any, Optional, Type, ClassVar
+from typing import (
+    Tuple, List, Dict, Set, FrozenSet, Iterable, Callable, Any, Optional,
+    Type, ClassVar
+)
 from dataclasses import dataclass, field
+from functools import cached_property
 import logging
 import os
+import pickle
+import hashlib
 import stat
 import re
-from collections import OrderedDict
+import string
 from pathlib import Path
 import shutil
-import requests
-from requests import Response
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from requests import Session, Response, RequestException
+from requests.adapters import HTTPAdapter
 import tarfile
 import yaml
 from tqdm import tqdm
 from jinja2 import Template, BaseLoader
 from jinja2 import Environment as Jinja2Environment
 from . import ProjectRepoError, Flattenable, Config
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
 
 logger = logging.getLogger(__name__)
 
@@ -38,7 +49,7 @@ class EnvironmentDistConfig(Config):
     environment: str = field()
     """The environment to export (i.e. ``default``, ``testur``)."""
 
-    platforms: Set[str] = field()
+    platforms: FrozenSet[str] = field()
     """The platforms to export (i.e. ``linux-64``)."""
 
     injects: Dict[str, List[Dict[str, str]]] = field()
@@ -82,8 +93,8 @@ class EnvironmentDistConfig(Config):
                 data, 'pixi_lock_file', 'the pixi lock file (pixi.lock)'),
             environment=cls._get(
                 data, 'environment', 'environment to export'),
-            platforms=set(cls._get(
-                data, 'platforms', 'platforms to export', set())),
+            platforms=frozenset(cls._get(
+                data, 'platforms', 'platforms to export', ())),
             injects=injects)
 
 
@@ -103,6 +114,17 @@ class Dependency(Flattenable):
         re.compile(r'^([A-Za-z0-9.]+(?:[_-][a-z0-9]+)*)-(V?[0-9.]+(?:-?(?:stable|beta|alpha|RC[0-9]))?)(.+)$'))
     _CONDA_ARCH_REGEX: ClassVar[re.Pattern] = re.compile(
         r'^http.*\/conda-forge\/([^\/]+)\/(.+).+$')
+    # bound match methods save a pattern attribute lookup on each call
+    _PYPI_ANY_MATCH: ClassVar[Callable] = _PYPI_ANY_REGEX.match
+    _URL_MATCH: ClassVar[Callable] = _URL_REGEX.match
+    _NAME_VER_MATCHES: ClassVar[Tuple[Callable, ...]] = tuple(
+        map(lambda p: p.match, _NAME_VER_REGEXS))
+    _CONDA_ARCH_MATCH: ClassVar[Callable] = _CONDA_ARCH_REGEX.match
+    _CONDA_SUFFIXES: ClassVar[Tuple[str, ...]] = ('.conda', '.tar.bz2')
+    _WHEEL_ANY_SUFFIXES: ClassVar[Tuple[str, ...]] = (
+        '-py3-none-any.whl', '-py2.py3-none-any.whl')
+    _CONDA_NAME_CHARS: ClassVar[FrozenSet[str]] = frozenset(
+        string.ascii_letters + string.digits + '-_.')
 
     is_conda: bool = field()
     """Whether the dependency is ``conda``  as apposed to ``pypi``."""
@@ -110,16 +132,21 @@ class Dependency(Flattenable):
     source: str = field()
     """The URL of the resource."""
 
+    sha256: Optional[str] = field(default=None)
+    """The SHA-256 hex digest of the resource given in the lock file, if
+    any.
+
+    """
+
     def __post_init__(self):
         self._local_file = None
 
-    def _get_url_parts(self) -> Tuple[str, str, str]:
-        if not hasattr(self, '_url_parts'):
-            m: re.Match = self._URL_REGEX.match(self.source)
-            self._url_parts: Tuple[str, ...] = (None, None, None)
-            if m is not None:
-                self._url_parts = m.groups()
-        return self._url_parts
+    @cached_property
+    def _url_parts(self) -> Tuple[str, str, str]:
+        m: re.Match = self._URL_MATCH(self.source)
+        if m is None:
+            return (None, None, None)
+        return m.groups()
 
     @property
     def is_file(self) -> bool:
@@ -127,68 +154,93 @@ class Dependency(Flattenable):
         to be confused with a cached file downloaded to the local file system.
 
         """
-        return self._get_url_parts()[1] is None
+        return self._url_parts[1] is None
 
     @property
     def source_file(self) -> str:
         """The file name porition of the url, which is the file name."""
-        return self._get_url_parts()[2]
+        return self._url_parts[2]
 
     @property
     def is_direct(self) -> bool:
         """Whether this is a Pip direct URL (i.e. ``<name> @ <url>``)."""
-        return self._get_url_parts()[0] is not None
+        return self._url_parts[0] is not None
 
-    @property
+    @cached_property
     def conda_platform(self) -> Optional[str]:
         """The platform of the conda dependency, or ``None`` if not a conda
         dependnecy.
 
         """
         if self.is_conda:
-            pat: re.Pattern = self._CONDA_ARCH_REGEX
-            m: re.Match = pat.match(self.source)
+            m: re.Match = self._CONDA_ARCH_MATCH(self.source)
             return m.group(1)
 
-    @property
+    @cached_property
     def is_platform_independent(self) -> bool:
         """Whether this is platform independent (i.e. ``py3-none-any``)."""
         if self.is_conda:
             return self.conda_platform == 'noarch'
         else:
-            return self._PYPI_ANY_REGEX.match(self.source) is not None
+            return self._PYPI_ANY_MATCH(self.source) is not None
 
     @property
     def url(self) -> Optional[str]:
         """The URL portion of the source (if it is a URL)."""
-        url: Tuple[str, str, str] = self._get_url_parts()
+        url: Tuple[str, str, str] = self._url_parts
         if url[1] is not None:
             return f'{url[1]}/{url[2]}'
 
-    def _get_name_version(self) -> Tuple[str, str]:
-        if not hasattr(self, '_name_version'):
-            self._name_version: Tuple[str, ...] = (None, None)
-            fname: str = self.source_file
-            if fname is not None:
-                pat: re.Pattern
-                for pat in self._NAME_VER_REGEXS:
-                    m: re.Match = pat.match(fname)
-                    if logger.isEnabledFor(logging.DEBUG):
-                        logger.debug(f'dep match: {fname} -> {m}')
-                    if m is not None:
-                        self._name_version = m.groups()
-                        break
-        return self._name_version
+    def _split_name_version(self, fname: str) -> Optional[Tuple[str, ...]]:
+        """Parse the name and version from a well formed conda or platform
+        independent wheel file name without the regular expressions.  This
+        gives the same groups as the respective expressions in
+        :obj:`_NAME_VER_REGEXS`, and ``None`` when the file name does not fit
+        the schema.
+
+        """
+        if fname.endswith(self._CONDA_SUFFIXES):
+            # <name>-<version>-<build>.conda
+            parts: List[str] = fname.rsplit('-', 2)
+            if len(parts) == 3 and len(parts[0]) > 0 and \
+               self._CONDA_NAME_CHARS.issuperset(parts[0]):
+                return tuple(parts)
+        else:
+            suffix: str
+            for suffix in self._WHEEL_ANY_SUFFIXES:
+                if fname.endswith(suffix):
+                    # <name>-<version>-py3-none-any.whl
+                    name, _, ver = fname[:-len(suffix)].rpartition('-')
+                    if len(name) > 0 and len(ver) > 0:
+                        return (name, ver)
+                    break
+
+    @cached_property
+    def _name_version(self) -> Tuple[str, str]:
+        fname: str = self.source_file
+        if fname is not None:
+            groups: Optional[Tuple[str, ...]] = \
+                self._split_name_version(fname)
+            if groups is not None:
+                return groups
+            match: Callable
+            for match in self._NAME_VER_MATCHES:
+                m: re.Match = match(fname)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f'dep match: {fname} -> {m}')
+                if m is not None:
+                    return m.groups()
+        return (None, None)
 
     @property
     def name(self) -> str:
         """The dependency name (i.e. ``numpy`` in ``numpy==1.26.0``)."""
-        return self._get_name_version()[0]
+        return self._name_version[0]
 
     @property
     def version(self) -> str:
         """The dependency version (i.e. ``1.26.0`` in ``numpy==1.26.0``)."""
-        return self._get_name_version()[1]
+        return self._name_version[1]
 
     @property
     def native_file(self) -> Optional[Path]:
@@ -232,13 +284,14 @@ class Dependency(Flattenable):
             'url': self.url,
             'is_file': self.is_file,
             'is_direct': self.is_direct,
-            'native_file': str(self.native_file)}
-        dct.update(super().asdict())
-        dct.pop('source')
-        dct['local_file'] = str(self.local_file)
+            'native_file': str(self.native_file),
+            'is_conda': self.is_conda,
+            'sha256': self.sha256,
+            'local_file': str(self.local_file)}
         return dct
 
-    def __str__(self) -> str:
+    @cached_property
+    def _str(self) -> str:
         s: str
         if self.is_file:
             s = str(self.native_file)
@@ -248,6 +301,9 @@ class Dependency(Flattenable):
             s = self.source
         return s
 
+    def __str__(self) -> str:
+        return self._str
+
 
 @dataclass(repr=False)
 class Platform(Flattenable):
@@ -345,6 +401,32 @@ class EnvironmentDistBuilder(Flattenable):
     _INSTALL_FILE: ClassVar[str] = 'install_env.sh'
     """The install file (in this module) to copy."""
 
+    _LOCK_CACHE_FILE: ClassVar[str] = 'pixi-lock.pkl'
+    """The temporary directory file name of the parsed ``pixi.lock`` cache."""
+
+    _DEP_TYPES: ClassVar[Dict[str, bool]] = {'conda': True, 'pypi': False}
+    """The lock file dependency types to whether the type is ``conda``."""
+
+    _ENV_CACHE_FILE: ClassVar[str] = 'pixi-env.pkl'
+    """The temporary directory file name of the :class:`.Environment` cache."""
+
+    _CACHE_VERSION: ClassVar[int] = 1
+    """The format version of the pickled caches, which is part of every cache
+    key.  Increment this when the parsed lock data or the layout (fields and
+    cached properties) of :class:`.Environment`, :class:`.Platform` or
+    :class:`.Dependency` changes so stale caches are no longer used.
+
+    """
+
+    _DOWNLOAD_WORKERS: ClassVar[int] = 16
+    """The number of threads used to download dependencies."""
+
+    _DOWNLOAD_CHUNK_SIZE: ClassVar[int] = 1 << 20
+    """The number of bytes read at a time when streaming a download to disk."""
+
+    _DOWNLOAD_TIMEOUT: ClassVar[float] = 60
+    """The number of seconds to wait to connect or for data when downloading."""
+
     config: EnvironmentDistConfig = field()
     """The parsed document generation configuration."""
 
@@ -370,13 +452,21 @@ class EnvironmentDistBuilder(Flattenable):
         self._jinja2_env = Jinja2Environment(
             loader=BaseLoader,
             keep_trailing_newline=True)
+        self._templates: Dict[str, Template] = {}
 
     def _render(self, template_content: str, params: Dict[str, Any]) -> str:
-        template: Template = self._jinja2_env.from_string(template_content)
+        # compile each distinct template source only once
+        template: Template = self._templates.get(template_content)
+        if template is None:
+            template = self._jinja2_env.from_string(template_content)
+            self._templates[template_content] = template
         return template.render(**params)
 
     def _assert_valid(self, lock: Dict[str, Any]):
         """Sanity check of the data parsed from the ``pixi.lock`` file."""
+        if not isinstance(lock, dict):
+            raise ProjectRepoError(
+                f'Not a pixi lock file: {self.config.pixi_lock_file}')
         ver: int = lock['version']
         if ver != self._PIXI_LOCK_VERSION:
             raise ProjectRepoError(
@@ -385,65 +475,135 @@ class EnvironmentDistBuilder(Flattenable):
             raise ProjectRepoError(
                 f'Environment {self.config.environment} is not provided')
 
+    def _get_lock_key(self) -> Tuple[str, int, int]:
+        """Return a key that changes when the ``pixi.lock`` file changes."""
+        path: Path = self.config.pixi_lock_file
+        st: os.stat_result = path.stat()
+        return (str(path.absolute()), st.st_mtime_ns, st.st_size)
+
+    def _load_cache(self, name: str, key: Any) -> Any:
+        """Return data pickled by :meth:`_save_cache` if it was saved with
+        ``key`` and the current :obj:`_CACHE_VERSION`, otherwise ``None``.
+
+        """
+        cache_file: Path = self.temporary_dir / name
+        key = (self._CACHE_VERSION, key)
+        if cache_file.is_file():
+            try:
+                with open(cache_file, 'rb') as f:
+                    cache_key, data = pickle.load(f)
+            except Exception as e:
+                logger.warning(f'ignoring unreadable cache {cache_file}: {e}')
+                return None
+            if cache_key == key:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f'using cached data: {cache_file}')
+                return data
+
+    def _save_cache(self, name: str, key: Any, data: Any):
+        """Pickle ``data`` to the temporary directory with its ``key``."""
+        cache_file: Path = self.temporary_dir / name
+        key = (self._CACHE_VERSION, key)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'caching data: {cache_file}')
+        with open(cache_file, 'wb') as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+
     @property
     def lock(self) -> Dict[str, Any]:
-        """The parsed data from the ``pixi.lock`` file."""
+        """The parsed data from the ``pixi.lock`` file.  The parsed data is
+        cached in the temporary directory until the lock file changes.
+
+        """
         if self._lock is None:
-            with open(self.config.pixi_lock_file) as f:
-                self._lock = yaml.load(f, yaml.FullLoader)
-            self._assert_valid(self._lock)
+            key: Tuple[str, int, int] = self._get_lock_key()
+            lock: Dict[str, Any] = self._load_cache(self._LOCK_CACHE_FILE, key)
+            if lock is None:
+                # the (C) loader reads bytes without decoding to text first
+                with open(self.config.pixi_lock_file, 'rb') as f:
+                    lock = yaml.load(f, Loader=_Loader)
+                self._save_cache(self._LOCK_CACHE_FILE, key, lock)
+            self._assert_valid(lock)
+            self._lock = lock
         return self._lock
 
-    def _get_environment(self) -> Environment:
+    def _create_environment(self) -> Environment:
         """Parse and return the Pixi lock file as an in-memory object graph."""
-        if self._env is None:
-            envs: Dict[str, Any] = self.lock['environments']
-            env: Dict[str, Any] = envs.get(self.config.environment)
-            pkgs: Dict[str, Any] = env['packages']
-            plats_avail: Set[str] = set(pkgs.keys())
-            plats_conf: Set[str] = self.config.platforms
-            plat_names: Set[str] = plats_conf \
-                if len(plats_conf) > 0 else plats_avail
-            plats_unavail: Set[str] = (plat_names - plats_avail)
-            plats: List[Platform] = []
+        envs: Dict[str, Any] = self.lock['environments']
+        env: Dict[str, Any] = envs.get(self.config.environment)
+        pkgs: Dict[str, Any] = env['packages']
+        plats_conf: FrozenSet[str] = self.config.platforms
+        plat_names: Iterable[str] = pkgs.keys()
+        plats: Dict[str, Platform] = {}
+        # availability only needs checking for configured platforms
+        if len(plats_conf) > 0:
+            plats_unavail: Set[str] = plats_conf.difference(pkgs)
             if len(plats_unavail) > 0:
                 plat_str: str = ', '.join(plats_unavail)
                 raise ProjectRepoError(
-                    f'Exported platforms requested but unavailable: {plat_str}')
+                    'Exported platforms requested but unavailable: ' +
+                    plat_str)
+            plat_names = plats_conf
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'env: {self.config.environment}')
+            logger.debug(f'pkgs: {len(pkgs)}')
+            logger.debug(f'plat_names: {len(plat_names)}')
+            logger.debug(f'plats conf: {len(plats_conf)}')
+        # package checksums are listed separately from the environments
+        hashes: Dict[str, str] = {}
+        pkg: Dict[str, Any]
+        for pkg in self.lock.get('packages', ()):
+            sha256: str = pkg.get('sha256')
+            if sha256 is not None:
+                hashes[pkg.get('conda', pkg.get('pypi'))] = sha256
+        all_injects = self.config.injects.get('all', ())
+        plat_name: str
+        for plat_name in plat_names:
+            deps: List[Dependency] = []
+            dep_specs: List[Dict[str, Any]] = list(pkgs[plat_name])
+            plat_injects = self.config.injects.get(plat_name, ())
+            dep_specs.extend(all_injects)
+            dep_specs.extend(plat_injects)
             if logger.isEnabledFor(logging.DEBUG):
-                logger.debug(f'env: {self.config.environment}')
-                logger.debug(f'pkgs: {len(pkgs)}')
-                logger.debug(f'plat_names: {len(plat_names)}')
-                logger.debug(f'plats avail: {len(plats_avail)}')
-                logger.debug(f'plats conf: {len(plats_conf)}')
-                logger.debug(f'plats unavail: {len(plats_unavail)}')
-            all_injects = self.config.injects.get('all', {})
-            plat_name: str
-            for plat_name in plat_names:
-                deps: List[Dependency] = []
-                dep_specs: List[Dict[str, Any]] = list(pkgs[plat_name])
-                plat_injects = self.config.injects.get(plat_name, {})
-                dep_specs.extend(all_injects)
-                dep_specs.extend(plat_injects)
+                logger.debug(f'deps for platform: {plat_name}')
+            dep: Dict[str, Any]
+            for dep in dep_specs:
+                dep_type: str
+                src: str
+                # each spec is a single type to source mapping
+                ((dep_type, src),) = dep.items()
+                try:
+                    is_conda: bool = self._DEP_TYPES[dep_type]
+                except KeyError:
+                    raise ProjectRepoError(
+                        f'Unknown dependency type: {dep_type}')
+                dep = Dependency(is_conda, src, hashes.get(src))
                 if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug(f'deps for platform: {plat_name}')
-                dep: Dict[str, Any]
-                for dep in dep_specs:
-                    assert len(dep) == 1
-                    dep_type: str
-                    src: str
-                    dep_type, src = next(iter(dep.items()))
-                    if dep_type != 'conda' and dep_type != 'pypi':
-                        raise ProjectRepoError(
-                            f'Unknown dependency type: {dep_type}')
-                    dep = Dependency(dep_type[0] == 'c', src)
-                    if logger.isEnabledFor(logging.DEBUG):
-                        logger.debug(f'adding dep: {dep}')
-                    deps.append(dep)
-                plats.append(Platform(plat_name, deps))
-            self._env = Environment(
-                name=self.config.environment,
-                platforms={p.name: p for p in plats})
+                    logger.debug(f'adding dep: {dep}')
+                deps.append(dep)
+            plats[plat_name] = Platform(plat_name, deps)
+        return Environment(
+            name=self.config.environment,
+            platforms=plats)
+
+    def _get_environment(self) -> Environment:
+        """Return the in-memory object graph of the Pixi lock file.  It is
+        cached in the temporary directory until the lock file or the exported
+        environment configuration changes.
+
+        """
+        if self._env is None:
+            key: Tuple[Any, ...] = (
+                self._get_lock_key(),
+                self.config.environment,
+                tuple(sorted(self.config.platforms)),
+                self.config.injects)
+            env: Environment = self._load_cache(self._ENV_CACHE_FILE, key)
+            if env is None:
+                env = self._create_environment()
+                self._save_cache(self._ENV_CACHE_FILE, key, env)
+            self._env = env
         return self._env
 
     def _get_subdir(self, dep: Dependency, plat: Platform,
@@ -470,50 +630,128 @@ class EnvironmentDistBuilder(Flattenable):
         else:
             return str(Path(par_dir, sub_dir))
 
-    def _fetch_or_download(self, platform: Platform, dep: Dependency):
-        """Fetch a dependency if it isn't already downloaded and set
-        :obj:`.Dependency.file` to the local file.
+    def _read_cache_dir(self, base_dir: Path) -> Set[str]:
+        """Return the names of the files already downloaded to a cache
+        directory, which is created if it doesn't exist.  One directory read
+        replaces a ``stat`` per dependency.
+
+        """
+        if base_dir.is_dir():
+            with os.scandir(base_dir) as entries:
+                return {e.name for e in entries}
+        base_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f'created directory: {base_dir}')
+        return set()
+
+    def _download(self, session: Session, dep: Dependency, local_file: Path):
+        """Download a dependency to the cache.
+
+        :param session: the HTTP session used to request the dependency
 
-        :param platform: the platform to which the dependency belongs
+        :param dep: the dependency to download
 
-        :param dep: the dependency to download and populate
+        :param local_file: the cached file to create
 
         """
-        if dep.is_file:
-            assert dep.native_file is not None
-            dep.local_file = dep.native_file
-        else:
-            url: str = dep.url
-            subdir: str = self._get_subdir(dep, platform)
-            base_dir: Path = self.config.cache_dir / subdir
-            if not base_dir.is_dir():
-                base_dir.mkdir(parents=True)
-                logger.info(f'created directory: {base_dir}')
-            local_file: Path = base_dir / dep.source_file
-            if logger.isEnabledFor(logging.DEBUG):
-                logger.debug(f'{url} -> {local_file}')
-            if not local_file.exists():
-                if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug(f'downloading from {url}')
-                res: Response = requests.get(url)
-                if res.status_code == 200:
-                    with open(local_file, 'wb') as f:
-                        f.write(res.content)
-                else:
-                    raise ProjectRepoError(f'Dependency download fail: {dep}')
-            dep.local_file = local_file
+        url: str = dep.url
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'downloading from {url} -> {local_file}')
+        # write to a partial file and rename it so the cache never has a
+        # truncated file that looks complete
+        part_file: Path = local_file.with_name(local_file.name + '.part')
+        res: Response
+        try:
+            with session.get(
+                    url, stream=True, timeout=self._DOWNLOAD_TIMEOUT) as res:
+                res.raise_for_status()
+                try:
+                    digest = hashlib.sha256()
+                    with open(part_file, 'wb') as f:
+                        chunk: bytes
+                        # iter_content decodes any content encoding
+                        for chunk in res.iter_content(
+                                self._DOWNLOAD_CHUNK_SIZE):
+                            digest.update(chunk)
+                            f.write(chunk)
+                    if dep.sha256 is not None and \
+                       digest.hexdigest() != dep.sha256:
+                        raise ProjectRepoError(
+                            f'Dependency checksum mismatch: {dep}')
+                    part_file.replace(local_file)
+                except BaseException:
+                    part_file.unlink(missing_ok=True)
+                    raise
+        except RequestException as e:
+            raise ProjectRepoError(
+                f'Dependency download fail: {dep}: {e}') from e
+
+    def _create_session(self) -> Session:
+        """Create an HTTP session with a connection pool large enough to keep
+        a connection alive for each download thread.
+
+        """
+        n_workers: int = self._DOWNLOAD_WORKERS
+        adapter = HTTPAdapter(
+            pool_connections=n_workers,
+            pool_maxsize=n_workers)
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def _download_dependencies(self):
-        """Download dependencies for the enviornment's configured platforms."""
+        """Download dependencies for the enviornment's configured platforms and
+        set each :obj:`.Dependency.local_file`.  The downloads are I/O bound,
+        so they are run concurrently in a thread pool sharing a single HTTP
+        session.
+
+        """
         env: Environment = self._get_environment()
+        cached: Dict[Path, Set[str]] = {}
+        # files to download with the dependencies that share them (i.e. the
+        # same noarch package in more than one platform)
+        downloads: Dict[Path, List[Dependency]] = {}
         plat: Platform
         for plat in env.platforms.values():
             logger.info(f'creating {repr(plat)} with {len(plat)} dependencies')
-            self._pbar.set_description(f'down {plat}')
             dep: Dependency
             for dep in plat.dependencies:
-                self._fetch_or_download(plat, dep)
+                if dep.is_file:
+                    assert dep.native_file is not None
+                    dep.local_file = dep.native_file
+                else:
+                    subdir: str = self._get_subdir(dep, plat)
+                    base_dir: Path = self.config.cache_dir / subdir
+                    local_file: Path = base_dir / dep.source_file
+                    names: Set[str] = cached.get(base_dir)
+                    if names is None:
+                        names = self._read_cache_dir(base_dir)
+                        cached[base_dir] = names
+                    if local_file.name not in names:
+                        downloads.setdefault(local_file, []).append(dep)
+                        continue
+                    dep.local_file = local_file
                 self._pbar.update(1)
+        self._pbar.set_description('download')
+        session: Session
+        with self._create_session() as session:
+            with ThreadPoolExecutor(self._DOWNLOAD_WORKERS) as pool:
+                futures: Dict[Future, Path] = {
+                    pool.submit(self._download, session, deps[0], local_file):
+                    local_file
+                    for local_file, deps in downloads.items()}
+                try:
+                    future: Future
+                    for future in as_completed(futures):
+                        future.result()
+                        local_file = futures[future]
+                        deps: List[Dependency] = downloads[local_file]
+                        for dep in deps:
+                            dep.local_file = local_file
+                        self._pbar.update(len(deps))
+                except BaseException:
+                    pool.shutdown(cancel_futures=True)
+                    raise
 
     def _get_relative_path(self, plat: Platform, dep: Dependency) -> str:
         if dep.is_file:
@@ -523,35 +761,55 @@ class EnvironmentDistBuilder(Flattenable):
             raise ProjectRepoError(f'Dependency has no name: {dep}')
         return f'{dep.name}=={dep.version}'
 
-    def _get_req_deps(self, plat: Platform) -> List[str]:
-        pdeps: List[str] = ['--no-index', f'--find-links ./{self._PYPI_NAME}']
-        for dep in filter(lambda d: not d.is_conda, plat.dependencies):
-            pdeps.append(self._get_relative_path(plat, dep))
-        return pdeps
+    def _get_dep_specs(self, plat: Platform) -> Tuple[List[str], List[str]]:
+        """Return the conda dependencies and pip requirements of a platform
+        partitioned in one pass over its dependencies.
 
-    def _get_environment_file(self, platform_name: str, add_pip: bool) -> str:
+        """
+        conda_deps: List[str] = []
+        pip_deps: List[str] = [
+            '--no-index', f'--find-links ./{self._PYPI_NAME}']
+        dep: Dependency
+        for dep in plat.dependencies:
+            (conda_deps if dep.is_conda else pip_deps).append(
+                self._get_relative_path(plat, dep))
+        return conda_deps, pip_deps
+
+    def _get_environment_file(
+            self, add_pip: bool,
+            dep_specs: Tuple[List[str], List[str]]) -> str:
         """The contents of the a platform's Conda ``environment.yml`` file.
 
-        :param platform_name: name of the platform to generate content
-
         :param add_pip: whether to add pip requirements
 
+        :param dep_specs: the platform's output of :meth:`_get_dep_specs`
+
         """
-        env: Environment = self._get_environment()
-        root: Dict[str, Any] = OrderedDict()
-        plat: Platform = env.platforms[platform_name]
-        deps: List[Dict[str, Any]] = []
+        root: Dict[str, Any] = {}
+        deps: List[Any]
+        pip_deps: List[str]
         root['name'] = self._render(
             template_content='{{ config.project.name  }}',
             params=self.template_params)
         root['channels'] = ['./local-channel', 'nodefaults']
-        dep: Dependency
-        for dep in filter(lambda d: d.is_conda, plat.dependencies):
-            deps.append(self._get_relative_path(plat, dep))
+        deps, pip_deps = dep_specs
         if add_pip:
-            deps.append({'pip': self._get_req_deps(plat)})
+            deps.append({'pip': pip_deps})
         root['dependencies'] = deps
-        return self._asyaml(root)
+        # keep the conventional environment.yml key order
+        return self._asyaml(root, sort_keys=False)
+
+    def _link_or_copy(self, src: Path, dst: Path):
+        """Hard link ``src`` to ``dst``, or copy it when the files are on
+        different file systems (or linking isn't supported).  The staged tree
+        is only read to create the archive, so it is safe to share the cached
+        file's inode rather than copy its contents.
+
+        """
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
 
     def _stage_tar(self):
         stage_dir: Path = self._stage_dir
@@ -566,14 +824,16 @@ class EnvironmentDistBuilder(Flattenable):
             add_pip: bool = plat.dependency_stats['non_wheels'] == 0
             param: Dict[str, Any] = dict(self.template_params)
             param['platform'] = plat
-            env_content: str = self._get_environment_file(plat.name, add_pip)
+            # both the environment and requirements files use the specs
+            dep_specs: Tuple[List[str], List[str]] = self._get_dep_specs(plat)
+            env_content: str = self._get_environment_file(add_pip, dep_specs)
             env_content = self._render(env_content, param)
             self._pbar.set_description(f'copy {plat}')
             env_file.write_text(env_content)
             logger.info(f'wrote: {env_file}')
             if not add_pip:
                 exe_mode: int = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
-                req_content: str = '\n'.join(self._get_req_deps(plat)) + '\n'
+                req_content: str = '\n'.join(dep_specs[1]) + '\n'
                 req_file: Path = stage_dir / f'{plat.name}-{self._REQ_FILE}'
                 src_inst_file = Path(__file__, f'../{self._INSTALL_FILE}')
                 dst_inst_file: Path = stage_dir / f'{plat.name}-install.sh'
@@ -591,7 +851,7 @@ class EnvironmentDistBuilder(Flattenable):
                 if targ.is_file():
                     continue
                 targ.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(dep.local_file, targ)
+                self._link_or_copy(dep.local_file, targ)
             channel_dir: str = f'{stage_dir}/{self._LOCAL_CHANNEL}'
             cmd: str = f'( cd {channel_dir}  ; conda index . )'
             if logger.level < logging.WARNING:
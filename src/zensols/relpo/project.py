@@ -3,7 +3,7 @@
 """
 from __future__ import annotations
 __author__ = 'Paul Landes'
-from typing import Tuple, Dict, Set, List, Any, Type, ClassVar
+from typing import Tuple, Dict, List, Any, Type, ClassVar
 from dataclasses import dataclass, field
 import os
 import logging
@@ -13,7 +13,11 @@ from pathlib import Path
 import pickle
 from io import TextIOBase, StringIO
 import yaml
-from jinja2 import Template, Environment, FileSystemLoader, BaseLoader
+from jinja2 import (
+    Template, Environment, FileSystemLoader, BaseLoader,
+    FileSystemBytecodeCache
+)
+from jinja2.bccache import Bucket
 import tomlkit as toml
 from tomlkit.toml_document import TOMLDocument
 from tomlkit.items import Table, InlineTable
@@ -24,10 +28,24 @@ from . import (
 from .repo import ProjectRepo
 from .doc import DocConfig, Documentor
 from .envdist import EnvironmentDistConfig, EnvironmentDistBuilder
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
 
 logger = logging.getLogger(__name__)
 
 
+class _TemplateBytecodeCache(FileSystemBytecodeCache):
+    """A compiled template cache that creates its directory only when the
+    first template is written to it.
+
+    """
+    def dump_bytecode(self, bucket: Bucket):
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+
 @dataclass
 class ProjectConfig(Config):
     """The :class:`.Project` configuration.
@@ -100,6 +118,14 @@ class Project(Flattenable):
 
     """
     _PYPROJECT_FILE: ClassVar[str] = 'pyproject.toml'
+    _STRING_ENV: ClassVar[Environment] = Environment(
+        loader=BaseLoader, keep_trailing_newline=True)
+    """The environment used to compile (non-file) string templates."""
+    _TEMPLATE_CACHE_DIR: ClassVar[str] = 'jinja'
+    """The :obj:`temporary_dir` relative directory of the compiled template
+    bytecode cache.
+
+    """
 
     config_files: Tuple[Path, ...] = field()
     """The project config files used to populate templates and docs."""
@@ -123,7 +149,7 @@ class Project(Flattenable):
             with open(path, 'r') as f:
                 content: str = f.read()
             content = self.render(content, template_params)
-            datas.append(yaml.load(StringIO(content), yaml.FullLoader))
+            datas.append(yaml.load(content, Loader=_Loader))
         return datas
 
     @property
@@ -132,20 +158,20 @@ class Project(Flattenable):
         data from all configuration files (:obj:`config_files`).
 
         """
-        def merge(a: dict, b: dict, path=[]) -> dict:
-            """Recursively merge dicts.
+        def merge(a: dict, b: dict) -> dict:
+            """Merge ``b`` into ``a`` giving preference to data in ``a`` (the
+            earlier dicts).  Nested dicts are merged using a stack rather than
+            recursion.
 
-            :see: `Stackoverflow <https://stackoverflow.com/questions/7204805/deep-merge-dictionaries-of-dictionaries-in-python>`_
             """
-            for key in b:
-                if key in a:
-                    if isinstance(a[key], dict) and isinstance(b[key], dict):
-                        merge(a[key], b[key], path + [str(key)])
-                    # allow overriding data giving preference to earlier dicts
-                    # elif a[key] != b[key]:
-                    #     raise Exception('Conflict at ' + '.'.join(path + [str(key)]))
-                else:
-                    a[key] = b[key]
+            stack: List[Tuple[dict, dict]] = [(a, b)]
+            while len(stack) > 0:
+                dst, src = stack.pop()
+                for key, val in src.items():
+                    if key not in dst:
+                        dst[key] = val
+                    elif isinstance(dst[key], dict) and isinstance(val, dict):
+                        stack.append((dst[key], val))
             return a
 
         if not hasattr(self, '_config'):
@@ -186,13 +212,24 @@ class Project(Flattenable):
 
     @property
     def releases(self) -> Tuple[Release, ...]:
-        changes: Tuple[ChangeLogEntry, ...] = self.change_log.entries
-        tags: Tuple[Tag, ...] = self.repo.tags
-        vtoc: Dict[Version, ChangeLogEntry] = {c.version: c for c in changes}
-        vtot: Dict[Version, Tag] = {t.version: t for t in tags}
-        match_vers: Set[Version] = set(vtoc.keys()) & set(vtot.keys())
-        return tuple(map(lambda v: Release(vtot[v], vtoc[v]),
-                         sorted(match_vers)))
+        """The releases that have both a Git tag and change log entry sorted by
+        version.
+
+        """
+        if not hasattr(self, '_releases'):
+            changes: Tuple[ChangeLogEntry, ...] = self.change_log.entries
+            tags: Tuple[Tag, ...] = self.repo.tags
+            vtoc: Dict[Version, ChangeLogEntry] = {
+                c.version: c for c in changes}
+            vtot: Dict[Version, Tag] = {t.version: t for t in tags}
+            # iterate over the smaller of the two and probe the larger
+            small, large = (vtoc, vtot) if len(vtoc) <= len(vtot) \
+                else (vtot, vtoc)
+            match_vers: List[Version] = [v for v in small if v in large]
+            match_vers.sort()
+            self._releases = tuple(map(lambda v: Release(vtot[v], vtoc[v]),
+                                       match_vers))
+        return self._releases
 
     def asdict(self) -> Dict[str, Any]:
         rels: Tuple[Release, ...] = self.releases
@@ -227,6 +264,12 @@ class Project(Flattenable):
         writer.write(template.render(**params))
         writer.write('\n')
 
+    @classmethod
+    @functools.lru_cache(maxsize=64)
+    def _compile_template(cls: Type, template_content: str) -> Template:
+        """Compile a template string, reusing previously compiled templates."""
+        return cls._STRING_ENV.from_string(template_content)
+
     def render(self, template_content: str,
                params: Dict[str, Any] = None) -> str:
         """Render a template using:
@@ -237,8 +280,7 @@ class Project(Flattenable):
             * ``config``: the project config (:obj:`config`)
 
         """
-        env = Environment(loader=BaseLoader, keep_trailing_newline=True)
-        template: Template = env.from_string(template_content)
+        template: Template = self._compile_template(template_content)
         params = self._get_template_params() if params is None else params
         return template.render(params)
 
@@ -282,8 +324,18 @@ class Project(Flattenable):
 
         """
         template_dir: Path = self.config.template_dir
-        lib_env = Environment(loader=FileSystemLoader(template_dir))
-        local_env = Environment(loader=FileSystemLoader(self.config.proj_dir))
+        bcc: FileSystemBytecodeCache = None
+        # only cache in temporary space that already exists (i.e. created by
+        # the build) so rendering does not create directories
+        if self.temporary_dir.is_dir():
+            bcc = _TemplateBytecodeCache(
+                str(self.temporary_dir / self._TEMPLATE_CACHE_DIR))
+        lib_env = Environment(
+            loader=FileSystemLoader(template_dir),
+            bytecode_cache=bcc)
+        local_env = Environment(
+            loader=FileSystemLoader(self.config.proj_dir),
+            bytecode_cache=bcc)
         sio = StringIO()
         params: Dict[str, Any] = self._get_template_params()
         self._render(lib_env, params, template_dir, self._PYPROJECT_FILE, sio)
@@ -302,6 +354,11 @@ class Project(Flattenable):
         is valid.
 
         """
+        if not hasattr(self, '_issue'):
+            self._issue = self._get_issue()
+        return self._issue
+
+    def _get_issue(self) -> str:
         reason: str = self._check_proj_dir(False)
         if reason is None:
             changes: Tuple[ChangeLogEntry, ...] = self.change_log.entries
@@ -322,8 +379,7 @@ class Project(Flattenable):
                 if len(rels) == 0:
                     reason = 'no matching releases'
                 else:
-                    rel: Release = self.releases[-1]
-                    reason = rel.issue
+                    reason = rels[-1].issue
         return reason
 
     def create_doc(self, output_dir: Path):
@@ -373,17 +429,26 @@ class ProjectFactory(object):
         with open(self._cache_file, 'rb') as f:
             return pickle.load(f)
 
-    def _latest_config_mtime(self) -> int:
-        return max(map(lambda p: p.stat().st_mtime, self.config_files))
+    def _is_stale(self, project: Project, cache_mtime: int) -> bool:
+        """Whether a config file or the project directory was modified after
+        the project was cached.  Checking stops at the first modified path.
+
+        :param cache_mtime: the cache file modification time in nanoseconds
+
+        """
+        paths: Tuple[Path, ...] = (*self.config_files, project.config.proj_dir)
+        return any(map(lambda p: os.stat(p).st_mtime_ns > cache_mtime, paths))
 
     def create(self) -> Project:
         project: Project = None
-        if self._cache_file.is_file():
+        cache_mtime: int = None
+        try:
+            cache_mtime = os.stat(self._cache_file).st_mtime_ns
+        except FileNotFoundError:
+            pass
+        if cache_mtime is not None:
             project = self._load()
-            pc_mtime: int = self._cache_file.stat().st_mtime
-            is_stale: bool = self._latest_config_mtime() > pc_mtime or \
-                project.proj_dir.stat().st_mtime > pc_mtime
-            if is_stale:
+            if self._is_stale(project, cache_mtime):
                 project = None
         if project is None:
             project = Project(self.config_files, self.temporary_dir)
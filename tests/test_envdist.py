@@ -1,18 +1,316 @@
-from typing import Dict
+from typing import Dict, List, Any, Callable
+from functools import lru_cache
+from pathlib import Path
+import os
+import errno
+import copy
+import shutil
+import hashlib
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+from requests import Session, HTTPError
+from tqdm import tqdm
 from util import TestBase
 import yaml
-from zensols.relpo.envdist import Dependency
+from zensols.relpo import ProjectRepoError
+from zensols.relpo.envdist import (
+    Dependency, Environment, Platform,
+    EnvironmentDistConfig, EnvironmentDistBuilder
+)
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+
+@lru_cache(maxsize=None)
+def _load_fixture(path: str) -> List[Any]:
+    """Parse a YAML test fixture only once for all tests."""
+    # read in one call and give the parser bytes to skip text decoding
+    return yaml.load(Path(path).read_bytes(), Loader=_Loader)
 
 
 class TestEnvironmentDist(TestBase):
     def test_dep_name_ver_parse(self):
-        with open('test-resources/dep-test.yml') as f:
-            deps_meta = yaml.load(f, yaml.FullLoader)
+        deps_meta: List[Dict[str, str]] = \
+            _load_fixture('test-resources/dep-test.yml')
         dep_meta: Dict[str, str]
         for dep_meta in deps_meta:
             self.assertEqual(1, len(dep_meta))
-            dep_type, src_should = tuple(dep_meta.items())[0]
+            dep_type, src_should = next(iter(dep_meta.items()))
             src, sname, sver = src_should.split()
             dep = Dependency(dep_type == 'conda', src)
             self.assertEqual(dep.name, sname, f'bad name: {dep}')
             self.assertEqual(dep.version, sver, f'bad version: {dep}')
+
+
+def _response(content: bytes) -> MagicMock:
+    """Return a stand-in for a streamed :class:`requests.Response`."""
+    res = MagicMock()
+    res.__enter__.return_value = res
+    res.iter_content.return_value = [content[:4], content[4:]]
+    return res
+
+
+class TestEnvironmentDistBuilder(TestBase):
+    _LIBGCC_URL = 'https://conda.anaconda.org/conda-forge/linux-64/' + \
+        '_libgcc_mutex-0.1-conda_forge.tar.bz2'
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.temporary_dir = Path(self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _create_builder(self, **params) -> EnvironmentDistBuilder:
+        # the configuration expands its injects in place, so copy the fixture
+        data: Dict[str, Any] = copy.deepcopy(
+            _load_fixture('test-resources/envdist.yml')['envdist'])
+        data.update(params)
+        return EnvironmentDistBuilder(
+            config=EnvironmentDistConfig.instance(data),
+            template_params={},
+            temporary_dir=self.temporary_dir,
+            output_file=self.temporary_dir / 'dist.tar',
+            progress=False)
+
+
+class TestEnvironmentDistDownload(TestEnvironmentDistBuilder):
+    def test_lock_sha256(self):
+        env: Environment = self._create_builder()._get_environment()
+        plat: Platform = env.platforms['linux-64']
+        deps: Dict[str, Dependency] = {d.source: d for d in plat.dependencies}
+        self.assertEqual(
+            '36c25b109e34dd147bf1ec12ed28943a356a1ef39c17684af3b1342e150e40f7',
+            deps[self._LIBGCC_URL].sha256)
+        interlap: Dependency = next(filter(
+            lambda d: d.name == 'interlap', plat.dependencies))
+        self.assertEqual(
+            '7080de0d3a731d8d9cd80a349a25e8a3057db21f257edd17d198b1be9e41e35e',
+            interlap.sha256)
+        # dependencies not listed in the lock packages have no digest
+        cython: Dependency = next(filter(
+            lambda d: d.name == 'Cython', plat.dependencies))
+        self.assertEqual(None, cython.sha256)
+
+    def _download(self, content: bytes, sha256: str) -> Path:
+        builder: EnvironmentDistBuilder = self._create_builder()
+        dep = Dependency(True, self._LIBGCC_URL, sha256)
+        local_file: Path = self.temporary_dir / dep.source_file
+        session: Session
+        with builder._create_session() as session:
+            with patch.object(Session, 'get', return_value=_response(content)):
+                builder._download(session, dep, local_file)
+        return local_file
+
+    def test_download_sha256(self):
+        content: bytes = b'conda package content'
+        local_file: Path = self._download(
+            content, hashlib.sha256(content).hexdigest())
+        self.assertEqual(content, local_file.read_bytes())
+        self.assertEqual(1, len(tuple(self.temporary_dir.iterdir())))
+
+    def test_download_sha256_mismatch(self):
+        content: bytes = b'conda package content'
+        with self.assertRaisesRegex(ProjectRepoError, r'checksum mismatch'):
+            self._download(content, hashlib.sha256(b'other').hexdigest())
+        # neither the partial nor the complete file is left in the cache
+        self.assertEqual(0, len(tuple(self.temporary_dir.iterdir())))
+
+
+class TestEnvironmentDistDownloadDependencies(TestEnvironmentDistBuilder):
+    _CONDA_URL = 'https://conda.anaconda.org/conda-forge'
+    _PYPI_URL = 'https://files.pythonhosted.org/packages/a1/b2'
+    # the noarch conda package and wheel are shared by both platforms
+    _LOCK = f"""\
+version: 6
+environments:
+  default:
+    packages:
+      linux-64:
+      - conda: {_CONDA_URL}/linux-64/pkga-1.0-h1.conda
+      - conda: {_CONDA_URL}/linux-64/pkgb-1.0-h1.conda
+      - conda: {_CONDA_URL}/noarch/pkgn-2.0-pyh1.conda
+      - pypi: {_PYPI_URL}/pkgw-3.1-py3-none-any.whl
+      osx-64:
+      - conda: {_CONDA_URL}/osx-64/pkgc-1.0-h1.conda
+      - conda: {_CONDA_URL}/noarch/pkgn-2.0-pyh1.conda
+      - pypi: {_PYPI_URL}/pkgw-3.1-py3-none-any.whl
+"""
+
+    def setUp(self):
+        super().setUp()
+        self.lock_file: Path = self.temporary_dir / 'pixi.lock'
+        self.lock_file.write_text(self._LOCK)
+        self.cache_dir: Path = self.temporary_dir / 'cache'
+        self.urls: List[str] = []
+
+    def _get(self, url: str, **kwargs) -> MagicMock:
+        self.urls.append(url)
+        return _response(url.encode())
+
+    def _download_dependencies(self, get: Callable = None) -> Environment:
+        builder: EnvironmentDistBuilder = self._create_builder(
+            pixi_lock_file=str(self.lock_file),
+            cache_dir=str(self.cache_dir),
+            environment='default',
+            platforms=[],
+            injects={})
+        builder._pbar = tqdm(disable=True)
+        with patch.object(Session, 'get', side_effect=get or self._get):
+            builder._download_dependencies()
+        return builder._get_environment()
+
+    def _assert_local_files(self, env: Environment):
+        plat: Platform
+        for plat in env.platforms.values():
+            dep: Dependency
+            for dep in plat.dependencies:
+                self.assertTrue(dep.local_file.is_file(), f'missing: {dep}')
+                self.assertEqual(dep.url.encode(), dep.local_file.read_bytes())
+
+    def test_shared_download(self):
+        env: Environment = self._download_dependencies()
+        # shared files are requested once for all platforms
+        self.assertEqual(5, len(self.urls))
+        self.assertEqual(5, len(set(self.urls)))
+        self._assert_local_files(env)
+        shared: List[Dependency] = [d for d in env.platforms['osx-64']
+                                    .dependencies if d.is_platform_independent]
+        self.assertEqual(2, len(shared))
+        dep: Dependency
+        for dep in shared:
+            linux_dep: Dependency = next(filter(
+                lambda d: d.source == dep.source,
+                env.platforms['linux-64'].dependencies))
+            self.assertEqual(linux_dep.local_file, dep.local_file)
+
+    def test_cached_download(self):
+        env: Environment = self._download_dependencies()
+        self.assertEqual(5, len(self.urls))
+        # files in the cache are not requested again
+        self.urls.clear()
+        env = self._download_dependencies()
+        self.assertEqual([], self.urls)
+        self._assert_local_files(env)
+        # only the file removed from the cache is requested
+        dep: Dependency = env.platforms['osx-64'].dependencies[0]
+        dep.local_file.unlink()
+        env = self._download_dependencies()
+        self.assertEqual([dep.url], self.urls)
+        self._assert_local_files(env)
+
+    def test_download_fail(self):
+        def get(url: str, **kwargs) -> MagicMock:
+            res: MagicMock = self._get(url)
+            if len(self.urls) == 1:
+                res.raise_for_status.side_effect = HTTPError('404 Not Found')
+            else:
+                # give the failure time to cancel the queued downloads
+                time.sleep(0.1)
+            return res
+
+        # queue all but the first download behind the one that fails
+        with patch.object(EnvironmentDistBuilder, '_DOWNLOAD_WORKERS', 1):
+            with self.assertRaisesRegex(ProjectRepoError, r'404 Not Found'):
+                self._download_dependencies(get)
+        # at most the download started before the cancel is requested
+        self.assertLessEqual(len(self.urls), 2, f'not cancelled: {self.urls}')
+        # the failed and cancelled downloads leave nothing in the cache
+        files: List[Path] = list(filter(
+            lambda p: p.is_file(), self.cache_dir.rglob('*')))
+        self.assertLessEqual(len(files), 1, f'not cancelled: {files}')
+        self.assertEqual([], list(self.cache_dir.rglob('*.part')))
+
+
+class TestEnvironmentDistStage(TestEnvironmentDistBuilder):
+    def setUp(self):
+        super().setUp()
+        self.src: Path = self.temporary_dir / 'pkg-1.0-h1.conda'
+        self.src.write_bytes(b'cached package')
+        self.dst: Path = self.temporary_dir / 'stage' / self.src.name
+        self.dst.parent.mkdir()
+
+    def test_link(self):
+        self._create_builder()._link_or_copy(self.src, self.dst)
+        self.assertEqual(b'cached package', self.dst.read_bytes())
+        self.assertTrue(self.dst.samefile(self.src))
+        self.assertEqual(2, self.src.stat().st_nlink)
+
+    def test_copy(self):
+        # linking fails across file systems
+        with patch('zensols.relpo.envdist.os.link',
+                   side_effect=OSError(errno.EXDEV, 'Invalid cross-device')):
+            self._create_builder()._link_or_copy(self.src, self.dst)
+        self.assertEqual(b'cached package', self.dst.read_bytes())
+        self.assertFalse(self.dst.samefile(self.src))
+        self.assertEqual(1, self.src.stat().st_nlink)
+
+
+class TestEnvironmentDistCache(TestEnvironmentDistBuilder):
+    def setUp(self):
+        super().setUp()
+        # a copy of the lock file so its modification time can be changed
+        self.lock_file: Path = self.temporary_dir / 'pixi.lock'
+        shutil.copyfile('test-resources/pixi-test.lock', self.lock_file)
+
+    def _create_builder(self, **params) -> EnvironmentDistBuilder:
+        params.setdefault('pixi_lock_file', str(self.lock_file))
+        return super()._create_builder(**params)
+
+    def _is_env_cached(self, **params) -> bool:
+        """Return whether a new builder uses the cached environment."""
+        builder: EnvironmentDistBuilder = self._create_builder(**params)
+        with patch.object(builder, '_create_environment',
+                          wraps=builder._create_environment) as create:
+            env: Environment = builder._get_environment()
+        self.assertTrue(isinstance(env, Environment))
+        return create.call_count == 0
+
+    def _is_lock_cached(self) -> bool:
+        """Return whether a new builder uses the cached lock file data."""
+        builder: EnvironmentDistBuilder = self._create_builder()
+        with patch('zensols.relpo.envdist.yaml.load', wraps=yaml.load) as load:
+            lock: Dict[str, Any] = builder.lock
+        self.assertEqual(6, lock['version'])
+        return load.call_count == 0
+
+    def _touch_lock(self):
+        st: os.stat_result = self.lock_file.stat()
+        os.utime(self.lock_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def test_env_cache(self):
+        self.assertFalse(self._is_env_cached())
+        self.assertTrue(self._is_env_cached())
+        # a different platform set misses, but the same set in any order hits
+        self.assertFalse(self._is_env_cached(platforms=['linux-64']))
+        self.assertTrue(self._is_env_cached(platforms=['linux-64']))
+        self.assertFalse(self._is_env_cached(platforms=['osx-64', 'linux-64']))
+        self.assertTrue(self._is_env_cached(platforms=['linux-64', 'osx-64']))
+        self._touch_lock()
+        self.assertFalse(self._is_env_cached())
+        self.assertTrue(self._is_env_cached())
+
+    def test_lock_cache(self):
+        self.assertFalse(self._is_lock_cached())
+        self.assertTrue(self._is_lock_cached())
+        self._touch_lock()
+        self.assertFalse(self._is_lock_cached())
+        self.assertTrue(self._is_lock_cached())
+
+    def test_empty_lock(self):
+        self.lock_file.write_bytes(b'')
+        with self.assertRaisesRegex(ProjectRepoError, r'Not a pixi lock file'):
+            self._create_builder().lock
+
+    def test_cache_version(self):
+        self.assertFalse(self._is_lock_cached())
+        self.assertFalse(self._is_env_cached())
+        # caches of a previous format are not used
+        version: int = EnvironmentDistBuilder._CACHE_VERSION + 1
+        with patch.object(EnvironmentDistBuilder, '_CACHE_VERSION', version):
+            self.assertFalse(self._is_lock_cached())
+            self.assertFalse(self._is_env_cached())
+            self.assertTrue(self._is_env_cached())
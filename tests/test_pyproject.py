@@ -1,23 +1,61 @@
+from typing import List
 from pathlib import Path
 from datetime import datetime
-from jinja2 import Template, Environment, FileSystemLoader
+from functools import lru_cache
+from unittest.mock import patch
+from jinja2 import (
+    Template, Environment, FileSystemLoader, FileSystemBytecodeCache
+)
 from zensols.relpo.project import Project
 from util import TestBase
 
+# compiled gold templates are kept in the build directory across test runs
+_TEMPLATE_CACHE_DIR = Path('target/jinja')
+# the one instant used by both the gold file and the project templates
+_NOW = datetime.now()
+
+
+class _FrozenDatetime(datetime):
+    """Gives :obj:`_NOW` as the current time to the rendered project."""
+    @classmethod
+    def now(cls, tz=None) -> datetime:
+        return _NOW
+
+
+@lru_cache(maxsize=None)
+def _env(dirpath: Path) -> Environment:
+    """Return a template environment shared by all tests for a directory."""
+    _TEMPLATE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(dirpath),
+        auto_reload=False,
+        cache_size=-1,
+        bytecode_cache=FileSystemBytecodeCache(str(_TEMPLATE_CACHE_DIR)))
+
+
+@lru_cache(maxsize=None)
+def _render_gold(path: Path, mtime: int, version: str) -> str:
+    """Render a gold file once per file modification and version."""
+    template: Template = _env(path.parent).get_template(path.name)
+    return template.render(
+        date=_NOW,
+        version=version)
+
 
 class TestPyProject(TestBase):
-    def _render(self, path: Path):
-        env = Environment(loader=FileSystemLoader(path.parent))
-        template: Template = env.get_template(path.name)
-        cmd: str = "git tag --sort='-version:refname' | head -1"
-        version: str = self._exec(cmd)
-        version = version.strip()[1:]
-        return template.render(
-            date=datetime.now(),
-            version=version)
+    @classmethod
+    def setUpClass(cls):
+        # load the project and render its pyproject.toml once for the class
+        project = Project((Path('test-resources/relpo.yml'),), Path('target'))
+        with patch('zensols.relpo.project.datetime', _FrozenDatetime):
+            cls.pyproject = project.pyproject
+
+    def _render(self, path: Path) -> str:
+        # not memoized since the tag tests add and remove tags
+        tags: List[str] = self._tags(count=1)
+        version: str = tags[0][1:] if len(tags) > 0 else ''
+        return _render_gold(path, path.stat().st_mtime_ns, version)
 
     def test_render(self):
-        project = Project((Path('test-resources/relpo.yml'),), Path('targt'))
         should: str = self._render(Path('test-resources/pyproject-gold.toml'))
-        content: str = project.pyproject
-        self.assertEqual(should, content)
+        self.assertEqual(should, self.pyproject)
@@ -1,8 +1,14 @@
+from typing import List
 import unittest
 import sys
 import subprocess as sub
 from unittest.case import _common_shorten_repr
 import difflib
+import itertools
+
+# lines of context before the first mismatch and maximum lines diffed
+_DIFF_CONTEXT = 3
+_DIFF_WINDOW = 200
 
 
 def assertMultiLineEqual(self, first, second, msg=None):
@@ -17,7 +23,16 @@ def assertMultiLineEqual(self, first, second, msg=None):
             firstlines = [first + '\n']
             secondlines = [second + '\n']
         standardMsg = '%s != %s' % _common_shorten_repr(first, second)
-        diff = '\n' + ''.join(difflib.unified_diff(firstlines, secondlines))
+        # only diff a window starting at the first mismatched line
+        start: int = sum(1 for _ in itertools.takewhile(
+            lambda lines: lines[0] == lines[1],
+            zip(firstlines, secondlines)))
+        start = max(0, start - _DIFF_CONTEXT)
+        end: int = start + _DIFF_WINDOW
+        diff = '\n' + ''.join(difflib.unified_diff(
+            firstlines[start:end], secondlines[start:end],
+            fromfile=f'first (line {start + 1})',
+            tofile=f'second (line {start + 1})'))
         standardMsg = self._truncateMessage(standardMsg, diff)
         self.fail(self._formatMessage(msg, standardMsg))
 
@@ -27,27 +42,38 @@ unittest.TestCase.assertMultiLineEqual = assertMultiLineEqual
 
 
 class TestBase(unittest.TestCase):
-    def setUp(self):
-        self.maxDiff = sys.maxsize
+    maxDiff = sys.maxsize
 
-    def _exec(self, cmd: str) -> str:
-        proc: sub.CompletedProcess = sub.run(cmd, shell=True, capture_output=True)
+    def _exec(self, argv: List[str]) -> str:
+        proc: sub.CompletedProcess = sub.run(argv, capture_output=True)
         out = proc.stdout.decode()
         err = proc.stderr.decode()
         self.assertEqual(0, proc.returncode, err)
         return out
 
+    def _tags(self, count: int = None) -> List[str]:
+        """Return the repository tag names sorted by descending version."""
+        argv: List[str] = ['git', 'for-each-ref', '--sort=-v:refname',
+                           '--format=%(refname:strip=2)']
+        if count is not None:
+            argv.append(f'--count={count}')
+        argv.append('refs/tags')
+        return self._exec(argv).split()
+
     def _assert_tags(self):
-        tags = self._exec('git tag').strip()
-        if len(tags.split('\n')) < 2:
-            self._exec('git config user.email "landes@mailc.net"')
-            self._exec('git config user.name "Paul Landes"')
-            self._exec('git tag -am "unit test tag 1" v0.0.1')
-            self._exec('git tag -am "unit test tag 2" v0.0.2')
+        tags: List[str] = self._tags()
+        if len(tags) < 2:
+            # give the tagger identity per command rather than in the config
+            git: List[str] = ['git', '-c', 'user.email=landes@mailc.net',
+                              '-c', 'user.name=Paul Landes', 'tag', '-am']
+            self._exec(git + ['unit test tag 1', 'v0.0.1'])
+            self._exec(git + ['unit test tag 2', 'v0.0.2'])
 
     def _delete_tags(self):
-        self._exec('git tag | xargs git tag -d')
+        tags: List[str] = self._tags()
+        if len(tags) > 0:
+            self._exec(['git', 'tag', '-d', *tags])
 
     def _restore_tags(self):
         self._delete_tags()
-        self._exec('git pull --tags')
+        self._exec(['git', 'pull', '--tags'])